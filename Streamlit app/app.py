@@ -6,7 +6,10 @@ from datetime import datetime, timedelta, timezone
 import pandas as pd
 import geopandas as gpd
 import plotly.graph_objects as go
-from huggingface_hub import hf_hub_download
+from huggingface_hub import hf_hub_download, HfFileSystem
+from huggingface_hub.utils import EntryNotFoundError
+import pyarrow as pa
+import pyarrow.dataset as ds
 import os
 
 # Access the Hugging Face token from the environment variable
@@ -15,11 +18,11 @@ st.set_page_config(layout="wide")
 st.title("Interactive Flood Risk Map")
 
 @st.cache_data
-def load_geojson():
+def load_geojson(filename="europe_admin.geojson"):
 
     geojson_path = hf_hub_download(
         repo_id="AdrienD-Skep/geo_flood_data",  # Repository name
-        filename="europe_admin.geojson",    # File name in the repository
+        filename=filename,    # File name in the repository
         repo_type="dataset",                # Type of repository
         token=hf_token,                        
     )
@@ -27,15 +30,114 @@ def load_geojson():
     gdf["last_update"] = pd.to_datetime(gdf["last_update"])
     return gdf
 
+# Map levels from the most aggregated one: (max zoom, geo file, tooltip fields, tooltip aliases).
+# The country and level 1 files are the rollups written by Update_geo_script/update_geo_data.py,
+# at the initial zoom only a few dozen polygons are sent to the browser.
+MAP_LEVELS = [
+    (4, "europe_admin_country.geojson", ["COUNTRY"], ["Pays"]),
+    (6, "europe_admin_level1.geojson", ["COUNTRY", "NAME_1"], ["Pays", "Région"]),
+    (None, "europe_admin.geojson", ["COUNTRY", "NAME_2"], ["Pays", "Région"]),
+]
+
+def get_map_level(zoom):
+    for level, (max_zoom, filename, fields, aliases) in enumerate(MAP_LEVELS):
+        if max_zoom is None or zoom <= max_zoom:
+            return level
+
+def load_map_level(level):
+    _, filename, fields, aliases = MAP_LEVELS[level]
+    try:
+        return load_geojson(filename), fields, aliases
+    except EntryNotFoundError:
+        # Rollups not published yet, fall back to the detailed regions
+        _, filename, fields, aliases = MAP_LEVELS[-1]
+        return load_geojson(filename), fields, aliases
+
+# Layout written by Update_geo_script/forecast_history.py
+HISTORY_PATH = "datasets/AdrienD-Skep/geo_flood_data/history"
+# Must match HISTORY_SCHEMA in Update_geo_script/forecast_history.py
+HISTORY_SCHEMA = pa.schema([
+    ("region_id", pa.int32()),
+    ("COUNTRY", pa.string()),
+    ("NAME_2", pa.string()),
+    ("run_date", pa.date32()),
+    ("lead_day", pa.int8()),
+    ("forecast_date", pa.date32()),
+    ("flood_proba", pa.float32()),
+    ("flood_type", pa.int8()),
+])
+
+# Must stay in sync with history_files in Update_geo_script/forecast_history.py
+def history_files(fs, start_date, end_date):
+    # File names carry their run dates, only the files overlapping the range are opened
+    selected = []
+    for path in fs.glob(f"{HISTORY_PATH}/*.parquet"):
+        name = os.path.basename(path)
+        if name.startswith("run_"):
+            first_day = last_day = datetime.strptime(name[len("run_"):-len(".parquet")], "%Y-%m-%d").date()
+        else:
+            first_day = datetime.strptime(name[len("month_"):-len(".parquet")], "%Y-%m").date()
+            last_day = (first_day + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        if first_day <= end_date and last_day >= start_date:
+            selected.append(path)
+    return selected
+
+@st.cache_data(ttl=3600)
+def load_region_history(region_id, country, name_2, days=365):
+    # Only the files of the period are opened, and in each of them only the
+    # row groups that can contain the region are downloaded.
+    # region_id is a row of the geo file, the names leave out the rows of another
+    # region that had the same row in an older geo file
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days)
+    fs = HfFileSystem(token=hf_token)
+    paths = history_files(fs, start_date, end_date)
+    if not paths:
+        return pd.DataFrame()
+    table = ds.dataset(paths, filesystem=fs, format="parquet", schema=HISTORY_SCHEMA).to_table(filter=(
+        (ds.field("region_id") == region_id)
+        & (ds.field("COUNTRY") == country)
+        & (ds.field("NAME_2") == name_2)
+        & (ds.field("run_date") >= start_date)
+    ))
+    return table.to_pandas()
+
+MAP_LOCATION = [54.5260, 15.2551]
+MAP_ZOOM = 3
+
 if "selected_region_data" not in st.session_state:
     st.session_state["selected_region_data"] = None
+if "last_clicked" not in st.session_state:
+    st.session_state["last_clicked"] = None
+if "map_zoom" not in st.session_state:
+    st.session_state["map_zoom"] = MAP_ZOOM
+    st.session_state["map_center"] = MAP_LOCATION
+    st.session_state["map_level"] = get_map_level(MAP_ZOOM)
+    st.session_state["map_level_view"] = (MAP_LOCATION, MAP_ZOOM)
+
+# The view returned by the map on the previous run decides which level to draw.
+map_view = st.session_state.get("map") or {}
+if map_view.get("zoom"):
+    st.session_state["map_zoom"] = map_view["zoom"]
+if map_view.get("center"):
+    st.session_state["map_center"] = [map_view["center"]["lat"], map_view["center"]["lng"]]
+map_level = get_map_level(st.session_state["map_zoom"])
+# The folium map is built at the view where its level was entered: within a level the map
+# script does not change and st_folium keeps the component, a new level starts where the user is
+if map_level != st.session_state["map_level"]:
+    st.session_state["map_level"] = map_level
+    st.session_state["map_level_view"] = (st.session_state["map_center"], st.session_state["map_zoom"])
 
-gdf = load_geojson()
+gdf, name_fields, name_aliases = load_map_level(map_level)
+# Must match FLOOD_TYPE_NOT_APPLICABLE in Update_geo_script/update_geo_data.py
+FLOOD_TYPE_NOT_APPLICABLE = -1
+NOT_APPLICABLE_COLOR = "#808080"
 # last_update = gdf["last_update"].iloc[0]
 # gdf["last_update"] = gdf["last_update"].dt.strftime('%Y-%m-%d')
 
 def create_folium_map(option):
-    m = folium.Map(location=[54.5260, 15.2551], zoom_start=3)
+    location, zoom = st.session_state["map_level_view"]
+    m = folium.Map(location=location, zoom_start=zoom)
 
 
     colormap_prob = cm.LinearColormap(
@@ -60,8 +162,13 @@ def create_folium_map(option):
                 value = float(raw_value) if is_float else int(raw_value)
             except (ValueError, TypeError):
                 value = 0.0 if is_float else 0
+            # Flood type not predicted by the updater (flood risk below the cascade threshold)
+            if not is_float and value == FLOOD_TYPE_NOT_APPLICABLE:
+                fill_color = NOT_APPLICABLE_COLOR
+            else:
+                fill_color = colormap(value)
             return {
-                "fillColor": colormap(value),
+                "fillColor": fill_color,
                 "color": "black",
                 "weight": 0.2,
                 "fillOpacity": 0.5,
@@ -81,21 +188,21 @@ def create_folium_map(option):
 
     if is_float :
         tooltip = folium.GeoJsonTooltip(
-            fields=["COUNTRY", "NAME_2", property_name],
-            aliases=["Pays", "Région", layer_name],
+            fields=name_fields + [property_name],
+            aliases=name_aliases + [layer_name],
         )
         popup = folium.GeoJsonPopup(
-            fields=["COUNTRY", "NAME_2", property_name],
-            aliases=["Pays", "Région", layer_name],
+            fields=name_fields + [property_name],
+            aliases=name_aliases + [layer_name],
         )
     else : 
         tooltip = folium.GeoJsonTooltip(
-            fields=["COUNTRY", "NAME_2", property_name+"_name"],
-            aliases=["Pays", "Région", layer_name],
+            fields=name_fields + [property_name+"_name"],
+            aliases=name_aliases + [layer_name],
         )
         popup = folium.GeoJsonPopup(
-            fields=["COUNTRY", "NAME_2", property_name+"_name"],
-            aliases=["Pays", "Région", layer_name],
+            fields=name_fields + [property_name+"_name"],
+            aliases=name_aliases + [layer_name],
         )
     
     folium.GeoJson(
@@ -154,6 +261,9 @@ def create_folium_map(option):
             <div class="legend-item">
                 <span style="background:#0494FA;"></span>Fluviale/Côtière
             </div>
+            <div class="legend-item">
+                <span style="background:#808080;"></span>Non applicable (risque faible)
+            </div>
             </div>
             """
         st.markdown(legend_html, unsafe_allow_html=True)
@@ -178,20 +288,26 @@ map_data = st_folium(
     width="100%",
     key="map",
     use_container_width=True,
-    returned_objects=["last_active_drawing"]
+    zoom=st.session_state["map_zoom"],
+    center=st.session_state["map_center"],
+    returned_objects=["last_active_drawing", "zoom", "center"]
 )
 
-if map_data.get("last_active_drawing"):
-    selected_region_data = map_data["last_active_drawing"]["properties"]
-    if selected_region_data == st.session_state.selected_region_data:
-        st.session_state.selected_region_data = None
-    else:
-        st.session_state.selected_region_data = selected_region_data
+# last_active_drawing keeps its value when the map is zoomed or moved,
+# only a click on another region changes the selection
+last_clicked = map_data.get("last_active_drawing")
+if last_clicked and last_clicked != st.session_state["last_clicked"]:
+    st.session_state["last_clicked"] = last_clicked
+    st.session_state.selected_region_data = last_clicked["properties"]
 
 
 with st.sidebar:
+    # last_clicked is kept: the same drawing is still returned by the map and must not select again
+    if st.session_state.selected_region_data and st.button("Fermer"):
+        st.session_state.selected_region_data = None
     if st.session_state.selected_region_data:
-        region_name = st.session_state.selected_region_data["NAME_2"] 
+        # Rollup layers have no NAME_2 (level 1) nor NAME_1 (country)
+        region_name = st.session_state.selected_region_data.get("NAME_2") or st.session_state.selected_region_data.get("NAME_1") or st.session_state.selected_region_data["COUNTRY"]
         st.title(f"{region_name}")
         df = pd.DataFrame({"date" : [st.session_state.selected_region_data["last_update"] + timedelta(days=i) for i in range(8)], "flood_proba" : [st.session_state.selected_region_data[f"flood_proba_{i}"]  for i in range(8)]})
         fig = go.Figure()
@@ -237,6 +353,54 @@ with st.sidebar:
         )
         st.plotly_chart(fig)
 
+        region_id = st.session_state.selected_region_data.get("region_id")
+        if region_id is not None:
+            history = load_region_history(int(region_id), st.session_state.selected_region_data["COUNTRY"],
+                                          st.session_state.selected_region_data["NAME_2"])
+        else:
+            history = pd.DataFrame()
+        if not history.empty:
+            # One column per lead day, one row per forecasted date
+            forecasts = history.pivot_table(index="forecast_date", columns="lead_day", values="flood_proba").sort_index()
+
+            fig_history = go.Figure()
+            for lead_day, name, color in [(0, "Prévision du jour", "white"), (7, "Prévision à 7 jours", "orange")]:
+                if lead_day in forecasts.columns:
+                    fig_history.add_trace(go.Scatter(
+                        x=forecasts.index,
+                        y=forecasts[lead_day],
+                        mode="lines",
+                        name=name,
+                        line=dict(color=color),
+                    ))
+            fig_history.update_layout(
+                title="Historique des prévisions",
+                xaxis_title="Date",
+                yaxis_title="Probabilité d'inondation en %",
+                legend=dict(orientation="h"),
+                yaxis=dict(
+                    range=[0, 100],
+                    showgrid=False,
+                ),
+            )
+            st.plotly_chart(fig_history)
+
+            if 0 in forecasts.columns and 7 in forecasts.columns:
+                drift = (forecasts[0] - forecasts[7]).dropna()
+                fig_drift = go.Figure()
+                fig_drift.add_trace(go.Bar(
+                    x=drift.index,
+                    y=drift,
+                    marker=dict(color=["red" if value > 0 else "royalblue" for value in drift]),
+                ))
+                fig_drift.update_layout(
+                    title="Écart entre la prévision du jour et celle à 7 jours",
+                    xaxis_title="Date",
+                    yaxis_title="Écart en points de %",
+                    showlegend=False,
+                )
+                st.plotly_chart(fig_drift)
+
 # Add credits section
 with st.expander("Source", expanded=False):
     st.markdown("""
@@ -0,0 +1,259 @@
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+
+from shapely.geometry import box
+from datetime import datetime, timedelta
+import subprocess
+import statistics
+import platform
+import tempfile
+import time
+
+import joblib
+import json
+import argparse
+import os
+
+import update_geo_data as updater
+from open_meteo_stub import start_stub_server, synthetic_values
+from run_report import report
+
+# Offline benchmark of the updater: Open-Meteo is replaced by the local stub and the
+# Hugging Face dataset by a temporary directory, so runs are comparable between commits.
+#   python Update_geo_script/benchmark.py --sizes 100 1000
+#   python Update_geo_script/benchmark.py --compare 667fec2 2f9459a
+
+RESULTS_DIR = "benchmark_results"
+CHUNK_SIZE = 100
+FORECAST_DAYS = 8
+WEATHER_VARIABLES = ["temperature_2m", "relative_humidity_2m", "dew_point_2m", "precipitation", "et0_fao_evapotranspiration", "vapour_pressure_deficit", "wind_speed_10m", "wind_gusts_10m"]
+
+# Synthetic regions are laid out on a grid over Europe
+EUROPE_BOUNDS = (-10.0, 36.0, 30.0, 70.0)
+REGIONS_PER_LEVEL1 = 25
+REGIONS_PER_COUNTRY = 250
+
+
+def synthetic_regions(n_regions, seed=0):
+    """GeoDataFrame with the columns of the published geo file, last updated yesterday."""
+    rng = np.random.default_rng(seed)
+    min_lon, min_lat, max_lon, max_lat = EUROPE_BOUNDS
+    n_cols = int(np.ceil(np.sqrt(n_regions * (max_lon - min_lon) / (max_lat - min_lat))))
+    n_rows = int(np.ceil(n_regions / n_cols))
+    cell_lon = (max_lon - min_lon) / n_cols
+    cell_lat = (max_lat - min_lat) / n_rows
+
+    ids = np.arange(n_regions)
+    west = min_lon + (ids % n_cols) * cell_lon
+    south = min_lat + (ids // n_cols) * cell_lat
+    gdf = gpd.GeoDataFrame({
+        "COUNTRY": [f"Country {i // REGIONS_PER_COUNTRY:03d}" for i in ids],
+        "NAME_1": [f"Level 1 {i // REGIONS_PER_LEVEL1:04d}" for i in ids],
+        "NAME_2": [f"Region {i:05d}" for i in ids],
+        "representative_point_lat": np.round(south + cell_lat / 2, 4),
+        "representative_point_lon": np.round(west + cell_lon / 2, 4),
+        "Sea latitude": np.round(south + cell_lat * rng.random(n_regions), 4),
+        "Sea longitude": np.round(west - cell_lon * rng.random(n_regions), 4),
+        "Sea distance": np.round(rng.gamma(2, 60, n_regions), 1),
+        "last_update": pd.Timestamp(datetime.now() - timedelta(days=1)),
+    }, geometry=[box(x, y, x + cell_lon, y + cell_lat) for x, y in zip(west, south)], crs="EPSG:4326")
+
+    # The updater writes its results into existing columns
+    for i in range(FORECAST_DAYS):
+        gdf[f"flood_proba_{i}"] = 0.0
+        gdf[f"flood_type_{i}"] = 0
+    for column in ["max_flood_proba", "mean_flood_proba", "median_flood_proba"]:
+        gdf[column] = 0.0
+    gdf["mode_flood_type"] = 0
+    gdf["mode_flood_type_name"] = updater.flood_type_name(0)
+    gdf["region_id"] = gdf.index
+    return gdf
+
+
+def timed(func, repeat):
+    """Wall times (seconds) of repeat calls of func, with the result of the last call."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def summary(times, rows):
+    best = min(times)
+    return {
+        "best": best,
+        "median": statistics.median(times),
+        "repeat": len(times),
+        "rows": rows,
+        "rows_per_second": rows / best if best > 0 else None,
+    }
+
+
+def fetch_chunk(chunk, end_date):
+    lat = chunk["representative_point_lat"].tolist()
+    lon = chunk["representative_point_lon"].tolist()
+    return (
+        updater.Get_previous_month_weather(lat, lon, end_date),
+        updater.Get_soil_moisture(lat, lon, end_date),
+        updater.get_river_discharge(lat, lon, end_date),
+        updater.Get_marine_weather(lat, lon, chunk["Sea latitude"].tolist(), chunk["Sea longitude"].tolist(),
+                                   chunk["Sea distance"].tolist(), end_date),
+    )
+
+
+def micro_benchmarks(repeat):
+    """Stages of the updater on one chunk of regions, fed by the stub."""
+    results = {}
+    chunk = synthetic_regions(CHUNK_SIZE)
+    end_date = datetime.now() + updater.delta_7_days
+    start_date = end_date - updater.delta_37_days
+
+    # One region of hourly weather, as returned by the forecast API
+    n_hours = ((end_date.date() - start_date.date()).days + 1) * 24
+    weather_data = {variable: synthetic_values(variable, 48.85, 2.35, n_hours, 3600) for variable in WEATHER_VARIABLES}
+    times, result_df = timed(lambda: updater.Create_df(weather_data, start_date + updater.delta_30_days, end_date), repeat)
+    results["create_df"] = summary(times, len(result_df))
+
+    times, chunk_data = timed(lambda: fetch_chunk(chunk, end_date), repeat)
+    results["fetch_chunk"] = summary(times, len(chunk))
+
+    times, complete_df = timed(lambda: updater.merge_chunk_data(*chunk_data), repeat)
+    results["merge"] = summary(times, len(complete_df))
+
+    predict_flood_model = joblib.load(updater.PREDICT_FLOOD_MODEL_PATH)
+    predict_type_model = joblib.load(updater.FLOOD_TYPE_MODEL_PATH)
+    times, _ = timed(lambda: updater.predict_flood(complete_df, predict_flood_model, predict_type_model), repeat)
+    results["inference"] = summary(times, len(complete_df))
+
+    times, _ = timed(lambda: chunk.apply(lambda x: updater.update_gdf(x, complete_df), axis=1), repeat)
+    results["update_gdf"] = summary(times, len(chunk))
+
+    for name, result in results.items():
+        updater.log(f"  {name}: best {result['best'] * 1000:.1f} ms, median {result['median'] * 1000:.1f} ms ({result['rows']} rows)")
+    return results
+
+
+def end_to_end(n_regions, work_dir):
+    """Full update_geo_data run (fetch, inference, geo file and rollup uploads) on n_regions."""
+    gdf = synthetic_regions(n_regions)
+    report.reset()
+    start = time.perf_counter()
+    updater.update_geo_data(gdf, pause=0)
+    wall_time = time.perf_counter() - start
+
+    updated_regions = int((gdf["last_update"].dt.date == datetime.now().date()).sum())
+    if updated_regions != n_regions:
+        updater.log(f"⚠️ {n_regions - updated_regions} of {n_regions} regions were not updated")
+    run = report.to_dict()
+    return {
+        "regions": n_regions,
+        "updated_regions": updated_regions,
+        "wall_time": wall_time,
+        "regions_per_second": n_regions / wall_time,
+        "cpu_time": run["run"]["cpu_time"],
+        "peak_rss_bytes": run["run"]["peak_rss_bytes"],
+        "geo_file_bytes": os.path.getsize(os.path.join(work_dir, "dataset", "europe_admin.geojson")),
+        "stages": run["stages"],
+    }
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True).stdout.strip()
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+    dirty = bool(git("status", "--porcelain", "--untracked-files=no"))
+    return commit, dirty
+
+
+def run_benchmarks(sizes, latency, repeat, results_dir, skip_micro=False):
+    commit, dirty = git_revision()
+    log_start = time.time()
+    # Models are loaded relative to the repository root, the updater writes its files in the working directory
+    repo_root = os.getcwd()
+    updater.PREDICT_FLOOD_MODEL_PATH = os.path.join(repo_root, updater.PREDICT_FLOOD_MODEL_PATH)
+    updater.FLOOD_TYPE_MODEL_PATH = os.path.join(repo_root, updater.FLOOD_TYPE_MODEL_PATH)
+
+    server, base_url = start_stub_server(latency=latency)
+    updater.OPEN_METEO_FORECAST_URL = f"{base_url}/v1/forecast"
+    updater.OPEN_METEO_FLOOD_URL = f"{base_url}/v1/flood"
+    updater.OPEN_METEO_MARINE_URL = f"{base_url}/v1/marine"
+    updater.log(f"Open-Meteo stub on {base_url} with {latency} seconds of latency")
+
+    results = {
+        "commit": commit,
+        "dirty": dirty,
+        "created_at": datetime.now().isoformat(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {"latency": latency, "repeat": repeat, "sizes": sizes, "chunk_size": CHUNK_SIZE},
+        "micro": {},
+        "end_to_end": {},
+    }
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            os.chdir(work_dir)
+            updater.geo_data_dir = os.path.join(work_dir, "dataset")
+            updater.OPEN_METEO_CACHE = os.path.join(work_dir, "open_meteo_cache")
+            if not skip_micro:
+                updater.log(f"Micro-benchmarks on a chunk of {CHUNK_SIZE} regions (best of {repeat})...")
+                results["micro"] = micro_benchmarks(repeat)
+            for n_regions in sizes:
+                updater.log(f"End-to-end run on {n_regions} synthetic regions...")
+                results["end_to_end"][str(n_regions)] = end_to_end(n_regions, work_dir)
+                updater.log(f"  {n_regions} regions in {results['end_to_end'][str(n_regions)]['wall_time']:.2f} seconds")
+    finally:
+        os.chdir(repo_root)
+        server.shutdown()
+
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f"{commit}{'-dirty' if dirty else ''}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    updater.log(f"🎉 Benchmark finished in {time.time() - log_start:.2f} seconds, results written to {path}")
+    return path
+
+
+def load_results(name, results_dir):
+    # A commit id or a path to a results file
+    path = name if os.path.exists(name) else os.path.join(results_dir, f"{name}.json")
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(base_name, new_name, results_dir):
+    base = load_results(base_name, results_dir)
+    new = load_results(new_name, results_dir)
+    rows = []
+    for name in sorted(set(base["micro"]) & set(new["micro"])):
+        rows.append((name, base["micro"][name]["best"], new["micro"][name]["best"]))
+    for size in sorted(set(base["end_to_end"]) & set(new["end_to_end"]), key=int):
+        base_run, new_run = base["end_to_end"][size], new["end_to_end"][size]
+        rows.append((f"end_to_end {size}", base_run["wall_time"], new_run["wall_time"]))
+        for stage in sorted(set(base_run["stages"]) & set(new_run["stages"])):
+            rows.append((f"  {stage}", base_run["stages"][stage]["wall_time"], new_run["stages"][stage]["wall_time"]))
+
+    if base["settings"]["latency"] != new["settings"]["latency"]:
+        updater.log(f"⚠️ Stub latency differs: {base['settings']['latency']} vs {new['settings']['latency']} seconds")
+    updater.log(f"{'':<32}{base['commit']:>12}{new['commit']:>12}{'ratio':>8}")
+    for name, base_time, new_time in rows:
+        ratio = f"{new_time / base_time:.2f}" if base_time > 0 else "-"
+        updater.log(f"{name:<32}{base_time:>12.4f}{new_time:>12.4f}{ratio:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the updater against a local Open-Meteo stub")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 10000], help="Synthetic region sets of the end-to-end runs")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added by the stub to every Open-Meteo response")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of each micro-benchmark (best and median are kept)")
+    parser.add_argument("--skip-micro", action="store_true", help="Only run the end-to-end benchmarks")
+    parser.add_argument("--results-dir", default=RESULTS_DIR, help="Directory of the results, one JSON file per commit")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), default=None,
+                        help="Compare two stored results (commit ids or file paths) instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare, args.results_dir)
+    else:
+        run_benchmarks(args.sizes, args.latency, args.repeat, args.results_dir, args.skip_micro)
@@ -0,0 +1,179 @@
+import pandas as pd
+import numpy as np
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from datetime import datetime, timedelta
+import time
+
+import argparse
+import os
+import tempfile
+
+from huggingface_hub import HfApi, HfFileSystem, CommitOperationAdd, CommitOperationDelete
+
+from update_geo_data import log, hf_token, FLOOD_TYPE_NOT_APPLICABLE
+
+# Append-only history of the nightly forecasts, stored next to the geo file in the dataset repo:
+#   history/run_YYYY-MM-DD.parquet  one file per run, written by the updater
+#   history/month_YYYY-MM.parquet   runs of a past month, rewritten by the compaction
+# Files are sorted by region_id with small row groups, the row group statistics let a
+# query for one region skip almost everything it does not need.
+# region_id is the row of the region in the geo file, which changes when the geo file is
+# regenerated: rows also carry COUNTRY and NAME_2 and readers filter on them too.
+
+REPO_ID = "AdrienD-Skep/geo_flood_data"
+HISTORY_DIR = "history"
+HISTORY_PATH = f"datasets/{REPO_ID}/{HISTORY_DIR}"
+FORECAST_DAYS = 8
+
+# ~256 regions per row group in a daily file, ~64 regions per row group once a month is compacted
+DAILY_ROW_GROUP_SIZE = 256 * FORECAST_DAYS
+MONTHLY_ROW_GROUP_SIZE = 64 * 31 * FORECAST_DAYS
+
+HISTORY_SCHEMA = pa.schema([
+    ("region_id", pa.int32()),
+    ("COUNTRY", pa.string()),
+    ("NAME_2", pa.string()),
+    ("run_date", pa.date32()),
+    ("lead_day", pa.int8()),
+    ("forecast_date", pa.date32()),
+    ("flood_proba", pa.float32()),
+    ("flood_type", pa.int8()),
+])
+SORT_COLUMNS = ["region_id", "run_date", "lead_day"]
+
+
+def history_rows(gdf, run_date):
+    """One row per (region, lead day) for the regions updated on run_date."""
+    updated = gdf[gdf["last_update"].dt.date == run_date]
+    frames = []
+    for lead_day in range(FORECAST_DAYS):
+        frames.append(pd.DataFrame({
+            "region_id": updated["region_id"].to_numpy(dtype=np.int32),
+            "COUNTRY": updated["COUNTRY"].to_numpy(),
+            "NAME_2": updated["NAME_2"].to_numpy(),
+            "run_date": run_date,
+            "lead_day": np.int8(lead_day),
+            "forecast_date": run_date + timedelta(days=lead_day),
+            "flood_proba": updated[f"flood_proba_{lead_day}"].to_numpy(dtype=np.float32),
+            "flood_type": updated[f"flood_type_{lead_day}"].fillna(FLOOD_TYPE_NOT_APPLICABLE).to_numpy(dtype=np.int8),
+        }))
+    return pd.concat(frames, ignore_index=True).sort_values(SORT_COLUMNS)
+
+
+def write_history_file(df, path, row_group_size):
+    table = pa.Table.from_pandas(df, schema=HISTORY_SCHEMA, preserve_index=False)
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+
+def append_run(api, gdf, run_date=None):
+    run_date = run_date or datetime.now().date()
+    rows = history_rows(gdf, run_date)
+    if rows.empty:
+        log("No region updated today, nothing to add to the forecast history")
+        return
+    upload_start = time.time()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"run_{run_date:%Y-%m-%d}.parquet")
+        write_history_file(rows, path, DAILY_ROW_GROUP_SIZE)
+        # A second run on the same day replaces the file of the first one
+        api.upload_file(
+            path_or_fileobj=path,
+            path_in_repo=f"{HISTORY_DIR}/run_{run_date:%Y-%m-%d}.parquet",
+            repo_id=REPO_ID,
+            repo_type="dataset",
+        )
+    log(f"✅ Forecast history: {len(rows)} rows added in {time.time() - upload_start:.2f} seconds")
+
+
+def compact_history(api, today=None):
+    """Rewrite the daily files of every finished month into a single monthly file."""
+    today = today or datetime.now().date()
+    fs = HfFileSystem(token=hf_token)
+    months = {}
+    for path in fs.glob(f"{HISTORY_PATH}/run_*.parquet"):
+        month = os.path.basename(path)[len("run_"):len("run_YYYY-MM")]
+        months.setdefault(month, []).append(path)
+
+    for month, daily_paths in sorted(months.items()):
+        if month >= f"{today:%Y-%m}":
+            continue
+        compaction_start = time.time()
+        monthly_path = f"{HISTORY_PATH}/month_{month}.parquet"
+        # Late daily files are folded into an existing monthly file, read last so their rows win
+        paths = ([monthly_path] if fs.exists(monthly_path) else []) + daily_paths
+        df = ds.dataset(paths, filesystem=fs, format="parquet", schema=HISTORY_SCHEMA).to_table().to_pandas()
+        df = df.drop_duplicates(subset=SORT_COLUMNS, keep="last").sort_values(SORT_COLUMNS)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_path = os.path.join(tmp_dir, f"month_{month}.parquet")
+            write_history_file(df, local_path, MONTHLY_ROW_GROUP_SIZE)
+            # Adding the monthly file and deleting the daily ones in one commit keeps the history consistent
+            operations = [CommitOperationAdd(path_in_repo=f"{HISTORY_DIR}/month_{month}.parquet", path_or_fileobj=local_path)]
+            operations += [CommitOperationDelete(path_in_repo=f"{HISTORY_DIR}/{os.path.basename(path)}") for path in daily_paths]
+            api.create_commit(
+                repo_id=REPO_ID,
+                repo_type="dataset",
+                operations=operations,
+                commit_message=f"Compact forecast history of {month}",
+            )
+        log(f"✅ Forecast history of {month} compacted ({len(daily_paths)} daily files, {len(df)} rows) in {time.time() - compaction_start:.2f} seconds")
+
+
+# Copied in "Streamlit app/app.py", both must stay in sync
+def history_files(fs, start_date, end_date):
+    # File names carry their run dates, only the files overlapping the range are opened
+    selected = []
+    for path in fs.glob(f"{HISTORY_PATH}/*.parquet"):
+        name = os.path.basename(path)
+        if name.startswith("run_"):
+            first_day = last_day = datetime.strptime(name[len("run_"):-len(".parquet")], "%Y-%m-%d").date()
+        else:
+            first_day = datetime.strptime(name[len("month_"):-len(".parquet")], "%Y-%m").date()
+            last_day = (first_day + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        if first_day <= end_date and last_day >= start_date:
+            selected.append(path)
+    return selected
+
+
+def read_region_history(region_id, country, name_2, start_date, end_date):
+    """Forecasts of one region issued between start_date and end_date (inclusive).
+
+    Rows of another region that had the same region_id in an older geo file are left out.
+    """
+    fs = HfFileSystem(token=hf_token)
+    paths = history_files(fs, start_date, end_date)
+    if not paths:
+        return pd.DataFrame(columns=HISTORY_SCHEMA.names)
+    dataset = ds.dataset(paths, filesystem=fs, format="parquet", schema=HISTORY_SCHEMA)
+    table = dataset.to_table(filter=(
+        (ds.field("region_id") == region_id)
+        & (ds.field("COUNTRY") == country)
+        & (ds.field("NAME_2") == name_2)
+        & (ds.field("run_date") >= start_date)
+        & (ds.field("run_date") <= end_date)
+    ))
+    return table.to_pandas().sort_values(["run_date", "lead_day"], ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the forecast history store")
+    parser.add_argument("--compact", action="store_true", help="Compact the daily files of the finished months")
+    parser.add_argument("--region-id", type=int, default=None, help="Print the forecast history of this region")
+    parser.add_argument("--country", default=None, help="COUNTRY of the region of --region-id")
+    parser.add_argument("--name-2", default=None, help="NAME_2 of the region of --region-id")
+    parser.add_argument("--days", type=int, default=365, help="History length for --region-id")
+    args = parser.parse_args()
+    if args.region_id is not None and (args.country is None or args.name_2 is None):
+        parser.error("--region-id needs --country and --name-2")
+
+    if args.compact:
+        compact_history(HfApi(token=hf_token))
+    if args.region_id is not None:
+        end_date = datetime.now().date()
+        query_start = time.time()
+        history = read_region_history(args.region_id, args.country, args.name_2, end_date - timedelta(days=args.days), end_date)
+        log(history.to_string())
+        log(f"{len(history)} rows read in {time.time() - query_start:.2f} seconds")
@@ -0,0 +1,235 @@
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+
+import openmeteo_requests
+import requests
+from retry_requests import retry
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+
+import joblib
+import hashlib
+import argparse
+import os
+
+from update_geo_data import (
+    Create_df, predict_flood, log, download_geo_file,
+    PREDICT_FLOOD_MODEL_PATH, FLOOD_TYPE_MODEL_PATH,
+    delta_30_days, delta_1_day,
+)
+
+# Historical re-scoring of the regions over a past date range.
+# Raw series are downloaded per batch of regions (one multi-location request per API)
+# and kept on disk, so re-scoring with a retrained model only costs local CPU.
+
+# Same variables as the updater to point the hindcast at a local stand-in (open_meteo_stub.py)
+ARCHIVE_URL = os.getenv("OPEN_METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+FLOOD_URL = os.getenv("OPEN_METEO_FLOOD_URL", "https://flood-api.open-meteo.com/v1/flood")
+MARINE_URL = os.getenv("OPEN_METEO_MARINE_URL", "https://marine-api.open-meteo.com/v1/marine")
+
+# The archive serves weather and soil moisture in one request (as in the training data gathering)
+WEATHER_VARIABLES = ["temperature_2m", "relative_humidity_2m", "dew_point_2m", "precipitation", "et0_fao_evapotranspiration", "vapour_pressure_deficit", "wind_speed_10m", "wind_gusts_10m",
+                     "soil_moisture_0_to_7cm", "soil_moisture_7_to_28cm", "soil_moisture_28_to_100cm", "soil_moisture_100_to_255cm"]
+MARINE_VARIABLES = ["wave_height", "sea_level_height_msl"]
+RIVER_VARIABLES = ["river_discharge"]
+
+OUTPUT_COLUMNS = ["region_id", "COUNTRY", "NAME_2", "date", "flood_proba", "flood_type"]
+
+
+def split_periods(start_date, end_date, period_days):
+    periods = []
+    period_start = start_date
+    while period_start <= end_date:
+        period_end = min(period_start + timedelta(days=period_days - 1), end_date)
+        periods.append((period_start, period_end))
+        period_start = period_end + delta_1_day
+    return periods
+
+
+def stack_variables(responses, kind, variables):
+    # One row per location, in the order the locations were requested
+    series = [getattr(response, kind)() for response in responses]
+    return {
+        name: np.stack([values.Variables(i).ValuesAsNumpy() for values in series])
+        for i, name in enumerate(variables)
+    }
+
+
+def fetch_batch(openmeteo, batch, start_date, end_date):
+    """Download the raw series of a batch of regions for [start_date - 30 days, end_date]."""
+    dates = {
+        "timezone": "GMT",
+        "start_date": (start_date - delta_30_days).strftime('%Y-%m-%d'),
+        "end_date": end_date.strftime('%Y-%m-%d'),
+    }
+    lat = batch["lat"].tolist()
+    lon = batch["lon"].tolist()
+
+    responses = openmeteo.weather_api(ARCHIVE_URL, params={"latitude": lat, "longitude": lon, "hourly": WEATHER_VARIABLES, **dates}, method="POST")
+    raw = stack_variables(responses, "Hourly", WEATHER_VARIABLES)
+    raw["elevation"] = np.array([response.Elevation() for response in responses])
+
+    responses = openmeteo.weather_api(FLOOD_URL, params={"latitude": lat, "longitude": lon, "daily": RIVER_VARIABLES, "models": "seamless_v4", **dates}, method="POST")
+    raw.update(stack_variables(responses, "Daily", RIVER_VARIABLES))
+
+    responses = openmeteo.weather_api(MARINE_URL, params={"latitude": batch["sea_lat"].tolist(), "longitude": batch["sea_lon"].tolist(), "hourly": MARINE_VARIABLES, **dates}, method="POST")
+    raw.update(stack_variables(responses, "Hourly", MARINE_VARIABLES))
+    return raw
+
+
+def raw_cache_path(cache_dir, batch, start_date, end_date):
+    # The key covers the exact region set so a different subset never reuses a wrong file
+    ids_hash = hashlib.sha1(batch["region_id"].to_numpy().tobytes()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{start_date:%Y%m%d}_{end_date:%Y%m%d}_{ids_hash}.npz")
+
+
+def batch_features(raw, batch, start_date, end_date):
+    """Same features as the live update, built with Create_df for each region of the batch."""
+    hourly_variables = WEATHER_VARIABLES + MARINE_VARIABLES
+    frames = []
+    for j, region in enumerate(batch.itertuples(index=False)):
+        df = Create_df({name: raw[name][j] for name in hourly_variables}, start_date, end_date)
+        river_df = Create_df({name: raw[name][j] for name in RIVER_VARIABLES}, start_date, end_date, 1)
+        df = pd.merge(df, river_df, on=["date", "date_id"])
+        df["elevation"] = raw["elevation"][j]
+        df["Sea distance"] = region.sea_distance
+        df["region_id"] = region.region_id
+        df["COUNTRY"] = region.COUNTRY
+        df["NAME_2"] = region.NAME_2
+        frames.append(df)
+    complete_df = pd.concat(frames, ignore_index=True)
+    complete_df["month"] = complete_df["date"].dt.month
+    return complete_df
+
+
+# Models are loaded once per worker process
+worker_models = None
+
+
+def init_worker(type_threshold):
+    global worker_models
+    predict_flood_model = joblib.load(PREDICT_FLOOD_MODEL_PATH)
+    predict_type_model = joblib.load(FLOOD_TYPE_MODEL_PATH)
+    # Parallelism comes from the process pool, one thread per model avoids oversubscription
+    for model in (predict_flood_model, predict_type_model):
+        model[-1].set_params(n_jobs=1)
+    worker_models = (predict_flood_model, predict_type_model, type_threshold)
+
+
+def score_batch(raw_path, batch, start_date, end_date, output_dir, part_name):
+    predict_flood_model, predict_type_model, type_threshold = worker_models
+    with np.load(raw_path) as raw:
+        complete_df = batch_features(raw, batch, start_date, end_date)
+    predict_flood(complete_df, predict_flood_model, predict_type_model, type_threshold)
+
+    result = complete_df[OUTPUT_COLUMNS].copy()
+    result["year_month"] = result["date"].dt.strftime("%Y-%m")
+    # Deterministic file names: re-running a period overwrites its previous results
+    result.to_parquet(
+        output_dir,
+        partition_cols=["year_month"],
+        index=False,
+        basename_template=f"{part_name}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+    return len(result)
+
+
+def load_regions(gdf, countries=None, region_ids=None):
+    regions = pd.DataFrame({
+        "region_id": gdf.index.to_numpy(),
+        "COUNTRY": gdf["COUNTRY"].to_numpy(),
+        "NAME_2": gdf["NAME_2"].to_numpy(),
+        "lat": gdf["representative_point_lat"].to_numpy(),
+        "lon": gdf["representative_point_lon"].to_numpy(),
+        "sea_lat": gdf["Sea latitude"].to_numpy(),
+        "sea_lon": gdf["Sea longitude"].to_numpy(),
+        "sea_distance": gdf["Sea distance"].to_numpy(),
+    })
+    if countries:
+        regions = regions[regions["COUNTRY"].isin(countries)]
+    if region_ids:
+        regions = regions[regions["region_id"].isin(region_ids)]
+    return regions.reset_index(drop=True)
+
+
+def hindcast(regions, start_date, end_date, output_dir, cache_dir, period_days=90, batch_size=100,
+             workers=None, type_threshold=None, fetch_pause=65):
+    log(f"Starting hindcast of {len(regions)} regions from {start_date:%Y-%m-%d} to {end_date:%Y-%m-%d}...")
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # No HTTP cache: the requests are POSTs, the downloaded batches are kept in cache_dir instead
+    retry_session = retry(requests.Session(), retries=5, backoff_factor=0.2)
+    openmeteo = openmeteo_requests.Client(session=retry_session)
+
+    futures = {}
+    fetched_batches = 0
+    failed_batches = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(type_threshold,)) as executor:
+        for start, end in split_periods(start_date, end_date, period_days):
+            for batch_start in range(0, len(regions), batch_size):
+                batch = regions.iloc[batch_start:batch_start + batch_size]
+                raw_path = raw_cache_path(cache_dir, batch, start, end)
+                name = f"{start:%Y%m%d}_{end:%Y%m%d}_{batch_start:06d}"
+                if not os.path.exists(raw_path):
+                    try:
+                        fetch_start = time.time()
+                        raw = fetch_batch(openmeteo, batch, start, end)
+                        # Written next to the final name then renamed, an interrupted fetch
+                        # must not leave a truncated file that would be taken for a cached batch
+                        with open(raw_path + ".tmp", "wb") as f:
+                            np.savez(f, **raw)
+                        os.replace(raw_path + ".tmp", raw_path)
+                        fetched_batches += 1
+                        log(f"  Fetched {name} ({len(batch)} regions) in {time.time() - fetch_start:.2f} seconds")
+                    except Exception as e:
+                        log(f"❌ ERROR fetching {name}: {str(e)}")
+                        failed_batches += 1
+                        continue
+                    finally:
+                        # Respect the Open-Meteo limits, cached batches are not throttled
+                        time.sleep(fetch_pause)
+                futures[executor.submit(score_batch, raw_path, batch, start, end, output_dir, name)] = name
+
+        scored_rows = 0
+        for future in as_completed(futures):
+            try:
+                scored_rows += future.result()
+            except Exception as e:
+                log(f"❌ ERROR scoring {futures[future]}: {str(e)}")
+                failed_batches += 1
+
+    total_time = time.time() - start_time
+    log(f"🎉 Hindcast finished: {scored_rows} region-days scored in {total_time:.2f} seconds "
+        f"({scored_rows / total_time * 3600:.0f} region-days per hour)")
+    log(f"  {fetched_batches} batches downloaded, {len(futures) - fetched_batches} from cache, {failed_batches} failed")
+    return scored_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score the regions over a past date range")
+    parser.add_argument("--start", required=True, type=lambda d: datetime.strptime(d, '%Y-%m-%d'), help="First day (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, type=lambda d: datetime.strptime(d, '%Y-%m-%d'), help="Last day, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--geo-file", default=None, help="Local geo file, downloaded from Hugging Face Hub by default")
+    parser.add_argument("--countries", nargs="+", default=None, help="Only score the regions of these countries")
+    parser.add_argument("--region-ids", nargs="+", type=int, default=None, help="Only score these regions (row index in the geo file)")
+    parser.add_argument("--output", default="hindcast_output", help="Parquet dataset directory, partitioned by month")
+    parser.add_argument("--cache-dir", default="hindcast_cache", help="Directory of the downloaded raw series")
+    parser.add_argument("--period-days", type=int, default=90, help="Days per archive request")
+    parser.add_argument("--batch-size", type=int, default=100, help="Regions per archive request and per scoring task")
+    parser.add_argument("--workers", type=int, default=None, help="Scoring processes, all cores by default")
+    parser.add_argument("--type-threshold", type=float, default=None,
+                        help="Cascade mode: only predict the flood type where the flood probability (%%) is above this threshold")
+    parser.add_argument("--fetch-pause", type=float, default=65, help="Seconds to wait after each download")
+    args = parser.parse_args()
+
+    geojson_path = args.geo_file or download_geo_file()
+    log("Loading GeoDataFrame...")
+    gdf = gpd.read_file(geojson_path)
+    regions = load_regions(gdf, args.countries, args.region_ids)
+    hindcast(regions, args.start, args.end, args.output, args.cache_dir, args.period_days, args.batch_size,
+             args.workers, args.type_threshold, args.fetch_pause)
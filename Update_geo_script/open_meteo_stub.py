@@ -0,0 +1,150 @@
+import numpy as np
+
+import flatbuffers
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timezone
+import threading
+import argparse
+import struct
+import time
+import zlib
+
+# Local stand-in for the Open-Meteo forecast, archive, flood and marine endpoints.
+# Answers in the FlatBuffers format read by openmeteo_requests, with plausible
+# synthetic series (deterministic per location) and a configurable latency.
+
+# (mean, daily amplitude, noise, min, max) of the synthetic series
+VARIABLE_PROFILES = {
+    "temperature_2m": (12, 5, 2, -30, 45),
+    "relative_humidity_2m": (70, 15, 8, 5, 100),
+    "dew_point_2m": (6, 3, 2, -35, 30),
+    "precipitation": (0.1, 0, 0.6, 0, 40),
+    "et0_fao_evapotranspiration": (0.1, 0.1, 0.03, 0, 1.5),
+    "vapour_pressure_deficit": (0.5, 0.4, 0.2, 0, 5),
+    "wind_speed_10m": (12, 4, 4, 0, 120),
+    "wind_gusts_10m": (25, 8, 8, 0, 180),
+    "soil_moisture_0_to_7cm": (0.3, 0, 0.01, 0, 0.6),
+    "soil_moisture_7_to_28cm": (0.3, 0, 0.005, 0, 0.6),
+    "soil_moisture_28_to_100cm": (0.3, 0, 0.003, 0, 0.6),
+    "soil_moisture_100_to_255cm": (0.3, 0, 0.002, 0, 0.6),
+    "river_discharge": (50, 0, 15, 0, 10000),
+    "wave_height": (1.2, 0.2, 0.4, 0, 15),
+    "sea_level_height_msl": (0, 0.8, 0.1, -5, 5),
+}
+DEFAULT_PROFILE = (0, 0, 1, -1e6, 1e6)
+
+# Field slots of the Open-Meteo FlatBuffers schema (openmeteo_sdk only ships the readers)
+RESPONSE_FIELDS, RESPONSE_LATITUDE, RESPONSE_LONGITUDE, RESPONSE_ELEVATION, RESPONSE_TIMEZONE, RESPONSE_DAILY, RESPONSE_HOURLY = 15, 0, 1, 2, 7, 10, 11
+SERIES_FIELDS, SERIES_TIME, SERIES_TIME_END, SERIES_INTERVAL, SERIES_VARIABLES = 4, 0, 1, 2, 3
+VARIABLE_FIELDS, VARIABLE_VALUES = 13, 3
+
+
+def synthetic_values(variable, lat, lon, n_values, interval):
+    rng = np.random.default_rng(zlib.crc32(f"{variable}:{lat:.4f}:{lon:.4f}".encode()))
+    mean, amplitude, noise, low, high = VARIABLE_PROFILES.get(variable, DEFAULT_PROFILE)
+    hours = np.arange(n_values) * interval / 3600
+    values = mean + amplitude * np.sin(2 * np.pi * hours / 24) + noise * rng.standard_normal(n_values)
+    if variable == "precipitation":
+        # Mostly dry hours with a few showers
+        values = np.where(rng.random(n_values) < 0.1, rng.gamma(1.5, 1.5, n_values), 0)
+    return np.clip(values, low, high).astype(np.float32)
+
+
+def parse_list(values):
+    # openmeteo_requests sends repeated keys, the real API also accepts comma separated lists
+    return [item for value in values for item in value.split(",") if item]
+
+
+def build_response(lat, lon, variables, kind, start, end):
+    """One size-prefixed WeatherApiResponse message, as streamed by Open-Meteo."""
+    interval = 3600 if kind == "hourly" else 86400
+    start_time = int(datetime(start.year, start.month, start.day, tzinfo=timezone.utc).timestamp())
+    n_values = ((end - start).days + 1) * 86400 // interval
+
+    builder = flatbuffers.Builder(1024 + 4 * n_values * len(variables))
+    variable_offsets = []
+    for variable in variables:
+        values = builder.CreateNumpyVector(synthetic_values(variable, lat, lon, n_values, interval))
+        builder.StartObject(VARIABLE_FIELDS)
+        builder.PrependUOffsetTRelativeSlot(VARIABLE_VALUES, values, 0)
+        variable_offsets.append(builder.EndObject())
+    builder.StartVector(4, len(variable_offsets), 4)
+    for offset in reversed(variable_offsets):
+        builder.PrependUOffsetTRelative(offset)
+    variables_vector = builder.EndVector()
+    builder.StartObject(SERIES_FIELDS)
+    builder.PrependInt64Slot(SERIES_TIME, start_time, 0)
+    builder.PrependInt64Slot(SERIES_TIME_END, start_time + n_values * interval, 0)
+    builder.PrependInt32Slot(SERIES_INTERVAL, interval, 0)
+    builder.PrependUOffsetTRelativeSlot(SERIES_VARIABLES, variables_vector, 0)
+    series = builder.EndObject()
+
+    timezone_name = builder.CreateString("GMT")
+    builder.StartObject(RESPONSE_FIELDS)
+    builder.PrependFloat32Slot(RESPONSE_LATITUDE, lat, 0)
+    builder.PrependFloat32Slot(RESPONSE_LONGITUDE, lon, 0)
+    builder.PrependFloat32Slot(RESPONSE_ELEVATION, float(abs(lat * lon) % 800), 0)
+    builder.PrependUOffsetTRelativeSlot(RESPONSE_TIMEZONE, timezone_name, 0)
+    builder.PrependUOffsetTRelativeSlot(RESPONSE_HOURLY if kind == "hourly" else RESPONSE_DAILY, series, 0)
+    builder.Finish(builder.EndObject())
+    message = builder.Output()
+    return struct.pack("<i", len(message)) + bytes(message)
+
+
+class OpenMeteoStubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+
+    def do_GET(self):
+        self.answer(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+        self.answer(parse_qs(body))
+
+    def answer(self, params):
+        time.sleep(self.latency)
+        try:
+            latitudes = [float(value) for value in parse_list(params["latitude"])]
+            longitudes = [float(value) for value in parse_list(params["longitude"])]
+            kind = "hourly" if "hourly" in params else "daily"
+            variables = parse_list(params[kind])
+            start = datetime.strptime(params["start_date"][0], "%Y-%m-%d")
+            end = datetime.strptime(params["end_date"][0], "%Y-%m-%d")
+        except (KeyError, ValueError) as e:
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(f'{{"error": true, "reason": "invalid request: {e}"}}'.encode())
+            return
+        body = b"".join(build_response(lat, lon, variables, kind, start, end) for lat, lon in zip(latitudes, longitudes))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(port=0, latency=0.0):
+    """Serve the stub in a background thread, returns (server, base URL)."""
+    handler = type("OpenMeteoStubHandler", (OpenMeteoStubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Open-Meteo stand-in")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.latency)
+    print(f"Open-Meteo stub listening on {base_url} (/v1/forecast, /v1/archive, /v1/flood, /v1/marine)", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from datetime import datetime
+import resource
+import time
+import json
+import os
+
+# Timings and counters of an updater run, written as a JSON report (and optionally a
+# Prometheus textfile) so that the cost of each stage can be followed night after night.
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def open_meteo_weight(n_locations, n_variables, n_days):
+    # Open-Meteo counts a call with more than 10 variables or more than 2 weeks as several calls
+    return n_locations * max(n_variables / 10, 1) * max(n_days / 14, 1)
+
+
+class RunReport:
+    COUNTERS = ["rows", "bytes", "api_weight"]
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started_at = datetime.now()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.stages = {}
+        self.info = {}
+
+    def get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_rss_growth_bytes": 0,
+                                 **{counter: 0 for counter in self.COUNTERS}}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name, **counters):
+        """Time a block of code, the counters (rows, bytes, api_weight) are added to the stage."""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        rss_start = peak_rss_bytes()
+        try:
+            yield
+        finally:
+            stage = self.get_stage(name)
+            stage["calls"] += 1
+            stage["wall_time"] += time.perf_counter() - wall_start
+            stage["cpu_time"] += time.process_time() - cpu_start
+            # ru_maxrss never goes down, the rise of the high-water mark during the stage shows
+            # which stage pushed the peak memory of the run
+            stage["peak_rss_growth_bytes"] += peak_rss_bytes() - rss_start
+            self.count(name, **counters)
+
+    def count(self, name, **counters):
+        stage = self.get_stage(name)
+        for counter, value in counters.items():
+            stage[counter] += value
+
+    def count_response_bytes(self, name):
+        """requests response hook adding the size of every downloaded (non cached) body to a stage."""
+        def hook(response, *args, **kwargs):
+            if not getattr(response, "from_cache", False):
+                self.count(name, bytes=len(response.content))
+        return hook
+
+    def to_dict(self):
+        return {
+            "run": {
+                **self.info,
+                "started_at": self.started_at.isoformat(),
+                "finished_at": datetime.now().isoformat(),
+                "wall_time": time.perf_counter() - self.start_wall,
+                "cpu_time": time.process_time() - self.start_cpu,
+                "peak_rss_bytes": peak_rss_bytes(),
+            },
+            "stages": self.stages,
+        }
+
+    def write_json(self, path):
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.to_dict(), f, indent=2, default=str)
+        os.replace(path + ".tmp", path)
+
+    def write_prometheus(self, path, prefix="flood_update"):
+        report = self.to_dict()
+        lines = []
+        for metric in ["wall_time", "cpu_time", "peak_rss_bytes"]:
+            unit = "" if metric.endswith("bytes") else "_seconds"
+            lines.append(f"# TYPE {prefix}_run_{metric}{unit} gauge")
+            lines.append(f"{prefix}_run_{metric}{unit} {report['run'][metric]}")
+        for metric in ["calls", "wall_time", "cpu_time", "peak_rss_growth_bytes"] + self.COUNTERS:
+            unit = "_seconds" if metric.endswith("time") else ""
+            lines.append(f"# TYPE {prefix}_stage_{metric}{unit} gauge")
+            for name, stage in self.stages.items():
+                lines.append(f'{prefix}_stage_{metric}{unit}{{stage="{name}"}} {stage[metric]}')
+        # The textfile collector may read at any time, the file is replaced in one step
+        with open(path + ".tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(path + ".tmp", path)
+
+
+# Report of the current run, filled by the updater functions
+report = RunReport()
@@ -0,0 +1,289 @@
+import pandas as pd
+import numpy as np
+
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.model_selection import train_test_split, StratifiedKFold
+from sklearn.metrics import accuracy_score, f1_score, brier_score_loss, log_loss, roc_auc_score
+from imblearn.over_sampling import ADASYN, RandomOverSampler
+from xgboost import XGBClassifier
+from skopt import Optimizer
+from skopt.space import Real, Integer
+from joblib import Parallel, delayed, parallel_config
+import time
+
+import joblib
+import hashlib
+import json
+import argparse
+import shutil
+import os
+
+from update_geo_data import log, PREDICT_FLOOD_MODEL_PATH, FLOOD_TYPE_MODEL_PATH
+from run_report import report
+
+# Retraining of the two models loaded by the updater, outside of the notebook.
+# The resampled train, test and cross-validation matrices are cached on disk as .npy
+# files and memory-mapped by the workers, so a new search does not redo the preparation.
+#   python Update_geo_script/train_models.py --n-iter 100
+
+SEED = 24
+TASKS = {
+    "flood": {
+        "data": "Notebooks/3 flood data analysis/output/complete_flood_data.csv",
+        "target": "is_flood",
+        "drop": ["lat", "lon", "Type", "Type_cd", "is_flood"],
+        "scoring": "neg_brier_score",
+        "model_path": PREDICT_FLOOD_MODEL_PATH,
+    },
+    "type": {
+        "data": "Notebooks/3 flood data analysis/output/Flood_Type_data.csv",
+        "target": "Type_cd",
+        "drop": ["lat", "lon", "Type", "Type_cd"],
+        "scoring": "f1_macro",
+        "model_path": FLOOD_TYPE_MODEL_PATH,
+    },
+}
+
+# Search space of the notebook, n_estimators is found by early stopping instead
+SEARCH_SPACE = {
+    "learning_rate": Real(0.001, 0.3, prior="log-uniform"),
+    "max_depth": Integer(3, 8),
+    "gamma": Real(0.0, 0.5),
+    "colsample_bytree": Real(0.6, 1.0),
+    "subsample": Real(0.6, 1.0),
+    "reg_alpha": Real(0.0, 1.0),
+    "reg_lambda": Real(0.0, 1.0),
+}
+
+SCORERS = {
+    "neg_brier_score": lambda y, proba: -brier_score_loss(y, proba[:, 1]),
+    "f1_macro": lambda y, proba: f1_score(y, proba.argmax(axis=1), average="macro"),
+}
+
+RESAMPLERS = {
+    "ros": RandomOverSampler,
+    "adasyn": ADASYN,
+}
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def save_matrices(directory, name, X, y):
+    np.save(os.path.join(directory, f"{name}_X.npy"), np.ascontiguousarray(X, dtype=np.float32))
+    np.save(os.path.join(directory, f"{name}_y.npy"), np.asarray(y, dtype=np.int32))
+
+
+def load_matrices(directory, name):
+    # Memory-mapped: the worker processes share the page cache instead of copying the matrices
+    return (np.load(os.path.join(directory, f"{name}_X.npy"), mmap_mode="r"),
+            np.load(os.path.join(directory, f"{name}_y.npy"), mmap_mode="r"))
+
+
+def prepare_task(task, data_path, cache_dir, features=None, cv=3, resampler="ros"):
+    """Cached matrices of a task, returns (cache directory, metadata).
+
+    Resampling is done inside each cross-validation fold, so the validation folds only hold
+    original rows. No scaling here: the trees are insensitive to it, the exported pipeline
+    still fits its StandardScaler once on the final training data.
+    """
+    settings = {"task": task, "features": features, "cv": cv, "resampler": resampler, "seed": SEED, "test_size": 0.2}
+    key = hashlib.sha1((file_hash(data_path) + json.dumps(settings, sort_keys=True)).encode()).hexdigest()[:12]
+    task_dir = os.path.join(cache_dir, f"{task}_{key}")
+    if os.path.exists(os.path.join(task_dir, "meta.json")):
+        log(f"  Using cached matrices {task_dir}")
+        with open(os.path.join(task_dir, "meta.json")) as f:
+            return task_dir, json.load(f)
+
+    config = TASKS[task]
+    df = pd.read_csv(data_path)
+    X = df.drop(columns=config["drop"])
+    if features is not None:
+        # The updater feeds both models with the columns of the flood model, in its order
+        missing = set(features) - set(X.columns)
+        if missing:
+            raise ValueError(f"{data_path} lacks {len(missing)} features of the flood model, e.g. {sorted(missing)[:5]}")
+        X = X[features]
+    y = df[config["target"]]
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=SEED, stratify=y)
+
+    # Written next to the final directory then renamed, an interrupted run leaves no half cache
+    tmp_dir = task_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    sampler = RESAMPLERS[resampler](random_state=SEED)
+    save_matrices(tmp_dir, "train", *sampler.fit_resample(X_train, y_train))
+    save_matrices(tmp_dir, "test", X_test, y_test)
+    save_matrices(tmp_dir, "full", *sampler.fit_resample(X, y))
+    folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=SEED)
+    for fold, (train_idx, valid_idx) in enumerate(folds.split(X_train, y_train)):
+        save_matrices(tmp_dir, f"fold{fold}_train", *sampler.fit_resample(X_train.iloc[train_idx], y_train.iloc[train_idx]))
+        save_matrices(tmp_dir, f"fold{fold}_valid", X_train.iloc[valid_idx], y_train.iloc[valid_idx])
+
+    meta = {**settings, "features": list(X.columns), "classes": sorted(int(c) for c in y.unique()), "rows": len(df)}
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(task_dir, ignore_errors=True)
+    os.replace(tmp_dir, task_dir)
+    log(f"  Matrices cached in {task_dir}")
+    return task_dir, meta
+
+
+def classifier(params, n_classes, threads, **kwargs):
+    return XGBClassifier(
+        **params,
+        tree_method="hist",
+        eval_metric="logloss" if n_classes == 2 else "mlogloss",
+        random_state=SEED,
+        n_jobs=threads,
+        **kwargs,
+    )
+
+
+def evaluate_candidate(task_dir, fold, params, n_classes, scoring, threads, max_estimators, early_stopping_rounds):
+    """Fit one candidate on one fold, returns (score, best number of trees, wall time)."""
+    start = time.perf_counter()
+    X_train, y_train = load_matrices(task_dir, f"fold{fold}_train")
+    X_valid, y_valid = load_matrices(task_dir, f"fold{fold}_valid")
+    model = classifier(params, n_classes, threads, n_estimators=max_estimators, early_stopping_rounds=early_stopping_rounds)
+    model.fit(X_train, y_train, eval_set=[(X_valid, y_valid)], verbose=False)
+    score = SCORERS[scoring](y_valid, model.predict_proba(X_valid))
+    return score, model.best_iteration + 1, time.perf_counter() - start
+
+
+def tune(task_dir, meta, scoring, n_iter, cv, points, workers, threads, max_estimators, early_stopping_rounds):
+    """Bayesian search, each batch of candidates x folds is fitted in parallel.
+
+    The batch size does not depend on the number of cores, the search gives the same
+    result on a laptop and on a CI runner.
+    """
+    optimizer = Optimizer(list(SEARCH_SPACE.values()), random_state=SEED)
+    n_classes = len(meta["classes"])
+    trials = []
+    # Each process runs `threads` XGBoost threads, BLAS/OpenMP pools are capped to the same
+    with parallel_config(backend="loky", n_jobs=workers, inner_max_num_threads=threads):
+        with Parallel() as parallel:
+            while len(trials) < n_iter:
+                batch_start = time.perf_counter()
+                candidates = optimizer.ask(n_points=min(points, n_iter - len(trials)))
+                candidate_params = [{name: value.item() if hasattr(value, "item") else value
+                                     for name, value in zip(SEARCH_SPACE, candidate)} for candidate in candidates]
+                results = parallel(
+                    delayed(evaluate_candidate)(task_dir, fold, params, n_classes, scoring, threads, max_estimators, early_stopping_rounds)
+                    for params in candidate_params for fold in range(cv)
+                )
+                scores = []
+                for i, params in enumerate(candidate_params):
+                    fold_results = results[i * cv:(i + 1) * cv]
+                    score = float(np.mean([result[0] for result in fold_results]))
+                    n_estimators = int(round(np.mean([result[1] for result in fold_results])))
+                    trials.append({"params": params, "score": score, "n_estimators": n_estimators,
+                                   "fit_time": sum(result[2] for result in fold_results)})
+                    scores.append(-score)
+                optimizer.tell(candidates, scores)
+                best = max(trials, key=lambda trial: trial["score"])
+                log(f"  Candidates {len(trials)}/{n_iter}: best {scoring} {best['score']:.5f} "
+                    f"(batch in {time.perf_counter() - batch_start:.2f} seconds)")
+    return max(trials, key=lambda trial: trial["score"]), trials
+
+
+def test_metrics(y, proba):
+    y_pred = proba.argmax(axis=1)
+    metrics = {
+        "accuracy": accuracy_score(y, y_pred),
+        "f1_macro": f1_score(y, y_pred, average="macro"),
+        "log_loss": log_loss(y, proba),
+    }
+    if proba.shape[1] == 2:
+        metrics["brier_score"] = brier_score_loss(y, proba[:, 1])
+        metrics["roc_auc"] = roc_auc_score(y, proba[:, 1])
+    return metrics
+
+
+def final_pipeline(task_dir, meta, name, best, threads):
+    """Pipeline of the updater (StandardScaler + XGBClassifier) fitted on one cached matrix."""
+    X, y = load_matrices(task_dir, name)
+    model = Pipeline(steps=[
+        ("standard_scaler", StandardScaler()),
+        ("Classifier", classifier(best["params"], len(meta["classes"]), threads, n_estimators=best["n_estimators"])),
+    ])
+    # A DataFrame keeps feature_names_in_, the updater selects its columns with it
+    model.fit(pd.DataFrame(X, columns=meta["features"]), y)
+    return model
+
+
+def export_model(model, path):
+    # Same default threading as the notebook models, the callers set n_jobs themselves
+    model[-1].set_params(n_jobs=None)
+    joblib.dump(model, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def train_task(task, data_path, args, features=None):
+    config = TASKS[task]
+    log(f"Training the {task} model from {data_path}...")
+    with report.stage(f"prepare_{task}"):
+        task_dir, meta = prepare_task(task, data_path, args.cache_dir, features, args.cv, args.resampler)
+
+    tuning_start = time.perf_counter()
+    with report.stage(f"tune_{task}", rows=args.n_iter * args.cv):
+        best, trials = tune(task_dir, meta, config["scoring"], args.n_iter, args.cv, args.points, args.workers,
+                            args.threads_per_fit, args.max_estimators, args.early_stopping_rounds)
+    tuning_time = time.perf_counter() - tuning_start
+    log(f"✅ {task} tuning: {len(trials)} candidates in {tuning_time:.2f} seconds, best {config['scoring']} {best['score']:.5f}")
+    log(f"  Best parameters: {best['params']}, {best['n_estimators']} trees")
+
+    all_threads = args.workers * args.threads_per_fit
+    with report.stage(f"evaluate_{task}"):
+        X_test, y_test = load_matrices(task_dir, "test")
+        model = final_pipeline(task_dir, meta, "train", best, all_threads)
+        metrics = test_metrics(y_test, model.predict_proba(pd.DataFrame(X_test, columns=meta["features"])))
+    log(f"  Test metrics: {metrics}")
+
+    report.info[task] = {"data": data_path, "tuning_wall_time": tuning_time, "best": best, "test_metrics": metrics}
+    if not args.no_export:
+        with report.stage(f"export_{task}"):
+            model = final_pipeline(task_dir, meta, "full", best, all_threads)
+            export_model(model, config["model_path"])
+        log(f"✅ {task} model written to {config['model_path']}")
+    return meta["features"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Retrain the flood probability and flood type models")
+    parser.add_argument("--tasks", nargs="+", choices=list(TASKS), default=list(TASKS), help="Models to train")
+    parser.add_argument("--flood-data", default=TASKS["flood"]["data"], help="CSV of the flood probability model")
+    parser.add_argument("--type-data", default=TASKS["type"]["data"], help="CSV of the flood type model")
+    parser.add_argument("--cache-dir", default="training_cache", help="Directory of the cached matrices")
+    parser.add_argument("--resampler", choices=list(RESAMPLERS), default="ros", help="Oversampling of the minority classes")
+    parser.add_argument("--n-iter", type=int, default=100, help="Candidates of the Bayesian search")
+    parser.add_argument("--cv", type=int, default=3, help="Cross-validation folds")
+    parser.add_argument("--points", type=int, default=8, help="Candidates proposed and fitted together")
+    parser.add_argument("--threads-per-fit", type=int, default=1, help="XGBoost threads of each fit")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel fits, all cores divided by --threads-per-fit by default")
+    parser.add_argument("--max-estimators", type=int, default=500, help="Upper bound of the number of trees")
+    parser.add_argument("--early-stopping-rounds", type=int, default=30, help="Rounds without improvement of the validation loss")
+    parser.add_argument("--no-export", action="store_true", help="Only report, keep the current models")
+    parser.add_argument("--report", default="training_report.json", help="JSON file of the timings, best parameters and test metrics")
+    args = parser.parse_args()
+    args.workers = args.workers or max(os.cpu_count() // args.threads_per_fit, 1)
+
+    report.info.update({"workers": args.workers, "threads_per_fit": args.threads_per_fit, "n_iter": args.n_iter, "cv": args.cv})
+    try:
+        features = None
+        # The flood model defines the feature order, the type model follows it
+        if "flood" in args.tasks:
+            features = train_task("flood", args.flood_data, args)
+        elif os.path.exists(PREDICT_FLOOD_MODEL_PATH):
+            features = list(joblib.load(PREDICT_FLOOD_MODEL_PATH).feature_names_in_)
+        if "type" in args.tasks:
+            train_task("type", args.type_data, args, features)
+    finally:
+        report.write_json(args.report)
+        log(f"Training report written to {args.report}")
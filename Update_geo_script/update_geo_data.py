@@ -11,12 +11,43 @@ import time
 import joblib
 import json
 
-from huggingface_hub import HfApi, hf_hub_download
+from huggingface_hub import HfApi, hf_hub_download, CommitOperationAdd
 
 import os
+import argparse
+import shutil
+
+from run_report import report, open_meteo_weight
 
 # Access the Hugging Face token from the environment variable
 hf_token = os.getenv("HF_TOKEN")
+# Local directory used instead of the Hugging Face dataset when set (offline runs, benchmarks)
+geo_data_dir = os.getenv("GEO_DATA_DIR")
+
+# Open-Meteo endpoints, overridable to point the updater at a local stand-in
+OPEN_METEO_FORECAST_URL = os.getenv("OPEN_METEO_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+OPEN_METEO_FLOOD_URL = os.getenv("OPEN_METEO_FLOOD_URL", "https://flood-api.open-meteo.com/v1/flood")
+OPEN_METEO_MARINE_URL = os.getenv("OPEN_METEO_MARINE_URL", "https://marine-api.open-meteo.com/v1/marine")
+OPEN_METEO_CACHE = '.cache'
+
+flood_types = ["Côtière", "Éclair", "Fluviale", "Fluviale/Côtière"]
+# Type given to region-days skipped by the cascade (flood risk below threshold)
+FLOOD_TYPE_NOT_APPLICABLE = -1
+FLOOD_TYPE_NOT_APPLICABLE_NAME = "Non applicable"
+
+PREDICT_FLOOD_MODEL_PATH = "Update_geo_script/models/model_XGBC_predict_flood.pkl"
+FLOOD_TYPE_MODEL_PATH = "Update_geo_script/models/model_XGBC_flood_type.pkl"
+
+# Aggregated layers shown by the app when zoomed out (GADM level 1 stands for NUTS-1)
+ROLLUP_LEVELS = {
+    "country": ["COUNTRY"],
+    "level1": ["COUNTRY", "NAME_1"],
+}
+# Simplification tolerance in degrees, borders finer than this are sub-pixel at the matching zoom
+ROLLUP_SIMPLIFY_TOLERANCE = {
+    "country": 0.05,
+    "level1": 0.01,
+}
 
 delta_37_days = timedelta(days=37)
 delta_30_days = timedelta(days=30)
@@ -66,13 +97,14 @@ def Create_df(data, start_date, end_date, day_time=24):
 def Get_previous_month_weather(lat, lon, end_date) :
 
     # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
+    cache_session = requests_cache.CachedSession(OPEN_METEO_CACHE, expire_after = 3600)
     retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
+    retry_session.hooks["response"].append(report.count_response_bytes("network_weather"))
     openmeteo = openmeteo_requests.Client(session = retry_session)
     start_date = end_date - delta_37_days
     # Make sure all required weather variables are listed here
     # The order of variables in hourly or daily is important to assign them correctly below
-    url = "https://api.open-meteo.com/v1/forecast"
+    url = OPEN_METEO_FORECAST_URL
     params = {
         "latitude": lat,
         "longitude": lon,
@@ -82,7 +114,9 @@ def Get_previous_month_weather(lat, lon, end_date) :
         "end_date": end_date.strftime('%Y-%m-%d'),
     }
 
-    responses = openmeteo.weather_api(url, params=params, method="POST")
+    n_days = (end_date - start_date).days + 1
+    with report.stage("network_weather", api_weight=open_meteo_weight(len(lat), len(params["hourly"]), n_days)):
+        responses = openmeteo.weather_api(url, params=params, method="POST")
     complete_result = []
     for j in range(len(responses)) :
         response = responses[j]
@@ -109,7 +143,9 @@ def Get_previous_month_weather(lat, lon, end_date) :
         weather_data["wind_speed_10m"] = hourly_wind_speed_10m
         weather_data["wind_gusts_10m"] = hourly_wind_gusts_10m
 
-        result_df = Create_df(weather_data, start_date + delta_30_days,end_date)
+        with report.stage("create_df"):
+            result_df = Create_df(weather_data, start_date + delta_30_days,end_date)
+        report.count("create_df", rows=len(result_df))
 
         result_df["elevation"] = elevation    
         result_df["lat"] = lat[j]
@@ -121,13 +157,14 @@ def Get_previous_month_weather(lat, lon, end_date) :
 def Get_soil_moisture(lat, lon, end_date) :
 
     # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
+    cache_session = requests_cache.CachedSession(OPEN_METEO_CACHE, expire_after = 3600)
     retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
+    retry_session.hooks["response"].append(report.count_response_bytes("network_soil_moisture"))
     openmeteo = openmeteo_requests.Client(session = retry_session)
     start_date = end_date - delta_37_days
     # Make sure all required weather variables are listed here
     # The order of variables in hourly or daily is important to assign them correctly below
-    url = "https://api.open-meteo.com/v1/forecast"
+    url = OPEN_METEO_FORECAST_URL
     params = {
         "latitude": lat,
         "longitude": lon,
@@ -137,7 +174,9 @@ def Get_soil_moisture(lat, lon, end_date) :
         "start_date": start_date.strftime('%Y-%m-%d'),
         "end_date": end_date.strftime('%Y-%m-%d'),
     }
-    responses = openmeteo.weather_api(url, params=params, method="POST")
+    n_days = (end_date - start_date).days + 1
+    with report.stage("network_soil_moisture", api_weight=open_meteo_weight(len(lat), len(params["hourly"]), n_days)):
+        responses = openmeteo.weather_api(url, params=params, method="POST")
     complete_result = []
     for j in range(len(responses)) :
         response = responses[j]
@@ -157,18 +196,21 @@ def Get_soil_moisture(lat, lon, end_date) :
         weather_data["soil_moisture_28_to_100cm"] = hourly_soil_moisture_28_to_100cm
         weather_data["soil_moisture_100_to_255cm"] = hourly_soil_moisture_100_to_255cm
         
-        result_df = Create_df(weather_data, start_date + delta_30_days,end_date)
+        with report.stage("create_df"):
+            result_df = Create_df(weather_data, start_date + delta_30_days,end_date)
+        report.count("create_df", rows=len(result_df))
         result_df["lat"] = lat[j]
         result_df["lon"] = lon[j]
         complete_result.append(result_df)
     return complete_result
 
 def get_river_discharge(lat,lon, end_date):
-    cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
+    cache_session = requests_cache.CachedSession(OPEN_METEO_CACHE, expire_after = 3600)
     retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
+    retry_session.hooks["response"].append(report.count_response_bytes("network_river"))
     openmeteo = openmeteo_requests.Client(session = retry_session)
     start_date = end_date - delta_37_days
-    url = "https://flood-api.open-meteo.com/v1/flood"
+    url = OPEN_METEO_FLOOD_URL
     params = {
         "latitude": lat,
         "longitude": lon,
@@ -178,7 +220,9 @@ def get_river_discharge(lat,lon, end_date):
         "models": "seamless_v4",
         "timezone": "GMT"
     }
-    responses = openmeteo.weather_api(url, params=params, method="POST")
+    n_days = (end_date - start_date).days + 1
+    with report.stage("network_river", api_weight=open_meteo_weight(len(lat), 1, n_days)):
+        responses = openmeteo.weather_api(url, params=params, method="POST")
     complete_result = []
     for j in range(len(responses)) :
         response = responses[j]
@@ -188,7 +232,9 @@ def get_river_discharge(lat,lon, end_date):
         daily_data = {}
         
         daily_data["river_discharge"] = daily_river_discharge
-        result_df = Create_df(daily_data, start_date + delta_30_days,end_date,1)
+        with report.stage("create_df"):
+            result_df = Create_df(daily_data, start_date + delta_30_days,end_date,1)
+        report.count("create_df", rows=len(result_df))
         result_df["lat"] = lat[j]
         result_df["lon"] = lon[j]
         complete_result.append(result_df)
@@ -196,11 +242,12 @@ def get_river_discharge(lat,lon, end_date):
 
 
 def Get_marine_weather(lat, lon, sea_lat, sea_lon, sea_distance, end_date):
-    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
+    cache_session = requests_cache.CachedSession(OPEN_METEO_CACHE, expire_after=3600)
     retry_session = retry(cache_session, retries=2, backoff_factor=0.1)  
+    retry_session.hooks["response"].append(report.count_response_bytes("network_marine"))
     openmeteo = openmeteo_requests.Client(session=retry_session)
     start_date = end_date - delta_37_days
-    url = "https://marine-api.open-meteo.com/v1/marine"
+    url = OPEN_METEO_MARINE_URL
     params = {
                 "latitude": sea_lat,
                 "longitude": sea_lon,
@@ -209,7 +256,9 @@ def Get_marine_weather(lat, lon, sea_lat, sea_lon, sea_distance, end_date):
                 "start_date": start_date.strftime('%Y-%m-%d'),
                 "end_date": end_date.strftime('%Y-%m-%d'),
             }
-    responses = openmeteo.weather_api(url, params=params, method="POST")
+    n_days = (end_date - start_date).days + 1
+    with report.stage("network_marine", api_weight=open_meteo_weight(len(sea_lat), len(params["hourly"]), n_days)):
+        responses = openmeteo.weather_api(url, params=params, method="POST")
     complete_result = []
     
     for j in range(len(responses)) :
@@ -223,18 +272,69 @@ def Get_marine_weather(lat, lon, sea_lat, sea_lon, sea_distance, end_date):
         hourly_data  = {}
         hourly_data["wave_height"] = hourly_wave_height
         hourly_data["sea_level_height_msl"] = hourly_sea_level_height_msl
-        result_df = Create_df(hourly_data, start_date + delta_30_days,end_date)
+        with report.stage("create_df"):
+            result_df = Create_df(hourly_data, start_date + delta_30_days,end_date)
+        report.count("create_df", rows=len(result_df))
         result_df["lat"] = lat[j]
         result_df["lon"] = lon[j]
         result_df["Sea distance"] = sea_distance[j]
         complete_result.append(result_df)
     return complete_result
 
+def merge_chunk_data(weather_data, soil_moisture_data, river_data, marine_weather_data):
+    """One row per (region, day) with the features of the four APIs."""
+    weather_df = pd.concat(weather_data)
+    soil_moisture_df = pd.concat(soil_moisture_data)
+    river_df = pd.concat(river_data)
+    marine_df = pd.concat(marine_weather_data)
+    complete_df = pd.merge(weather_df, soil_moisture_df,on=["date", "lat", "lon", "date_id"])
+    complete_df = pd.merge(complete_df, river_df,on=["date", "lat", "lon", "date_id"])
+    complete_df = pd.merge(complete_df, marine_df,on=["date", "lat", "lon", "date_id"])
+    complete_df["month"] = complete_df['date'].dt.month
+    return complete_df
+
+def predict_flood(df, predict_flood_model, predict_type_model, type_threshold=None):
+    """Add flood_proba (%) and flood_type columns to df.
+
+    With type_threshold set, the flood type model only runs on the rows whose
+    flood_proba is strictly above the threshold (cascade mode), the other rows
+    get FLOOD_TYPE_NOT_APPLICABLE.
+    Returns (rows, typed_rows, type_inference_time) for reporting.
+    """
+    ordered_features = predict_flood_model.feature_names_in_
+    X = df[ordered_features]
+    predicted_flood_proba = predict_flood_model.predict_proba(X)
+    df["flood_proba"] = np.round(predicted_flood_proba[:,1] * 100)
+
+    type_start = time.time()
+    if type_threshold is None:
+        df["flood_type"] = predict_type_model.predict(X)
+        typed_rows = len(df)
+    else:
+        at_risk = (df["flood_proba"] > type_threshold).to_numpy()
+        flood_type = np.full(len(df), FLOOD_TYPE_NOT_APPLICABLE, dtype=np.int64)
+        if at_risk.any():
+            flood_type[at_risk] = predict_type_model.predict(X[at_risk])
+        df["flood_type"] = flood_type
+        typed_rows = int(at_risk.sum())
+    return len(df), typed_rows, time.time() - type_start
+
+def flood_type_name(flood_type):
+    if flood_type == FLOOD_TYPE_NOT_APPLICABLE:
+        return FLOOD_TYPE_NOT_APPLICABLE_NAME
+    return flood_types[int(flood_type)]
+
 def update_gdf(row , df):
     df_location = df[(df["lat"] == row["representative_point_lat"]) & (df["lon"] == row["representative_point_lon"])]
     date_ids = df_location["date_id"].unique()
 
-    row["mode_flood_type"] = df_location[f"flood_type"].mode().iloc[0]
+    # Days skipped by the cascade only count when no day has a predicted type
+    applicable_types = df_location.loc[df_location["flood_type"] != FLOOD_TYPE_NOT_APPLICABLE, "flood_type"]
+    if applicable_types.empty:
+        row["mode_flood_type"] = FLOOD_TYPE_NOT_APPLICABLE
+    else:
+        row["mode_flood_type"] = applicable_types.mode().iloc[0]
+    row["mode_flood_type_name"] = flood_type_name(row["mode_flood_type"])
     for date_id in date_ids :
         row[f"flood_type_{date_id}"] = df_location[(df_location["date_id"] == date_id)]["flood_type"].iloc[0]
 
@@ -249,16 +349,190 @@ def update_gdf(row , df):
 def log(message):
         print(message, flush=True)
 
-def update_geo_data(gdf):
+class LocalDatasetApi:
+    """Stand-in for HfApi writing the dataset files to a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def upload_file(self, path_or_fileobj, path_in_repo, **kwargs):
+        path = os.path.join(self.root, path_in_repo)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(path_or_fileobj, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def create_commit(self, operations, **kwargs):
+        for operation in operations:
+            if isinstance(operation, CommitOperationAdd):
+                self.upload_file(operation.path_or_fileobj, operation.path_in_repo)
+            else:
+                os.remove(os.path.join(self.root, operation.path_in_repo))
+
+def get_dataset_api():
+    if geo_data_dir:
+        return LocalDatasetApi(geo_data_dir)
+    return HfApi(token=hf_token)
+
+def download_geo_file():
+    if geo_data_dir:
+        return os.path.join(geo_data_dir, "europe_admin.geojson")
+    log("Downloading geo file from Hugging Face Hub...")
+    download_start = time.time()
+    with report.stage("download"):
+        geojson_path = hf_hub_download(
+            repo_id="AdrienD-Skep/geo_flood_data",  # Repository name
+            filename="europe_admin.geojson",    # File name in the repository
+            repo_type="dataset",                # Type of repository
+            token=hf_token,                        
+        )
+    report.count("download", bytes=os.path.getsize(geojson_path))
+    log(f"Download completed in {time.time() - download_start:.2f} seconds")
+    return geojson_path
+
+def upload_geo_file(api, gdf):
+    upload_start = time.time()
+    # Written next to the final name then renamed, so a crash never leaves a truncated file
+    with report.stage("serialize", rows=len(gdf)):
+        gdf.to_file("europe_admin.geojson.tmp", driver="GeoJSON")
+        os.replace("europe_admin.geojson.tmp", "europe_admin.geojson")
+
+    with report.stage("upload", bytes=os.path.getsize("europe_admin.geojson")):
+        api.upload_file(
+            path_or_fileobj="europe_admin.geojson",  # Path to the local file
+            path_in_repo="europe_admin.geojson",     # Path in the repository
+            repo_id="AdrienD-Skep/geo_flood_data",       # Repository name
+            repo_type="dataset",                     # Type of repository
+        )
+    log(f"✅ Upload completed in {time.time() - upload_start:.2f} seconds")
+
+def rollup_filename(level):
+    return f"europe_admin_{level}.geojson"
+
+def dominant_flood_type(flood_type):
+    applicable_types = flood_type[flood_type != FLOOD_TYPE_NOT_APPLICABLE].dropna()
+    if applicable_types.empty:
+        return FLOOD_TYPE_NOT_APPLICABLE
+    return applicable_types.mode().iloc[0]
+
+def build_rollup(gdf, level):
+    """Dissolve the regions of gdf by country or level 1 region with their flood statistics."""
+    keys = ROLLUP_LEVELS[level]
+    aggregations = {
+        "max_flood_proba": "max",
+        "mean_flood_proba": "mean",
+        "median_flood_proba": "median",
+        "mode_flood_type": dominant_flood_type,
+        "last_update": "max",
+        **{f"flood_proba_{i}": "max" for i in range(8)},
+    }
+    aggregations = {column: func for column, func in aggregations.items() if column in gdf.columns}
+    rollup = gdf[keys + list(aggregations) + ["geometry"]].dissolve(by=keys, aggfunc=aggregations, as_index=False)
+    rollup["mode_flood_type_name"] = rollup["mode_flood_type"].apply(flood_type_name)
+    rollup["geometry"] = rollup.simplify(ROLLUP_SIMPLIFY_TOLERANCE[level], preserve_topology=True)
+    return rollup
+
+def upload_rollups(api, gdf):
+    # The rollups are only a display layer, a failure must not stop the run (nor the forecast history)
+    try:
+        upload_start = time.time()
+        operations = []
+        for level in ROLLUP_LEVELS:
+            with report.stage("rollups", rows=len(gdf)):
+                rollup = build_rollup(gdf, level)
+            filename = rollup_filename(level)
+            with report.stage("serialize", rows=len(rollup)):
+                rollup.to_file(filename + ".tmp", driver="GeoJSON")
+                os.replace(filename + ".tmp", filename)
+            operations.append(CommitOperationAdd(path_in_repo=filename, path_or_fileobj=filename))
+            log(f"  {level} layer: {len(rollup)} polygons")
+        # Both layers are published in one commit so the app never mixes two runs
+        with report.stage("upload", bytes=sum(os.path.getsize(rollup_filename(level)) for level in ROLLUP_LEVELS)):
+            api.create_commit(
+                repo_id="AdrienD-Skep/geo_flood_data",
+                repo_type="dataset",
+                operations=operations,
+                commit_message="Update rollup layers",
+            )
+        log(f"✅ Rollup layers uploaded in {time.time() - upload_start:.2f} seconds")
+    except Exception as e:
+        log(f"❌ ERROR publishing the rollup layers: {str(e)}")
+
+def parse_shard(value):
+    # "i/N" -> (i, N), shards are numbered from 0
+    try:
+        shard_index, shard_count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected i/N")
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected 0 <= i < N")
+    return shard_index, shard_count
+
+def select_shard(gdf, shard_index, shard_count):
+    # Taking every N-th region spreads each shard over the whole of Europe
+    return gdf[gdf.index % shard_count == shard_index].copy()
+
+def partial_path(partial_dir, shard_index, shard_count):
+    return os.path.join(partial_dir, f"partial_{shard_index}_of_{shard_count}.parquet")
+
+def write_partial(gdf, partial_dir, shard_index, shard_count):
+    """Save the attributes of a shard (every column but the geometry) for the merge step."""
+    os.makedirs(partial_dir, exist_ok=True)
+    attributes = pd.DataFrame(gdf.drop(columns="geometry"))
+    path = partial_path(partial_dir, shard_index, shard_count)
+    attributes.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    log(f"Partial file written: {path} ({len(attributes)} regions)")
+
+def merge_partials(gdf, partial_dir, shard_count):
+    """Rebuild the geo file from the partial files of the N shards.
+
+    Raises ValueError unless every region of gdf is covered by exactly one partial file.
+    """
+    paths = [partial_path(partial_dir, i, shard_count) for i in range(shard_count)]
+    missing_paths = [path for path in paths if not os.path.exists(path)]
+    if missing_paths:
+        raise ValueError(f"Missing partial files: {missing_paths}")
+    attributes = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+
+    duplicated_ids = attributes.loc[attributes["region_id"].duplicated(), "region_id"].unique()
+    if len(duplicated_ids) > 0:
+        raise ValueError(f"{len(duplicated_ids)} regions covered by several shards, e.g. {duplicated_ids[:10].tolist()}")
+    attributes = attributes.set_index("region_id", drop=False)
+    missing_ids = gdf.index.difference(attributes.index)
+    unknown_ids = attributes.index.difference(gdf.index)
+    if len(missing_ids) > 0 or len(unknown_ids) > 0:
+        raise ValueError(f"{len(missing_ids)} regions not covered and {len(unknown_ids)} unknown regions in the partial files")
+    attributes = attributes.loc[gdf.index]
+    # Catches partial files computed from another version of the geo file
+    mismatched = pd.Series(False, index=gdf.index)
+    for column in ["COUNTRY", "NAME_2"]:
+        mismatched |= attributes[column].fillna("") != gdf[column].fillna("")
+    if mismatched.any():
+        raise ValueError(f"{mismatched.sum()} regions do not match the geo file, e.g. {gdf.index[mismatched][:10].tolist()}")
+
+    stale_regions = (attributes["last_update"].dt.date != datetime.now().date()).sum()
+    if stale_regions > 0:
+        log(f"⚠️ {stale_regions} regions were not updated today")
+    merged = gdf[["geometry"]].join(attributes)
+    return merged[list(attributes.columns) + ["geometry"]]
+
+def update_geo_data(gdf, type_threshold=None, upload=True, pause=65):
     log("Starting geo data update process...")
     CHUNK_SIZE = 100
     TOTAL_ROWS = len(gdf)
     start_time = time.time()
-    api = HfApi(token=hf_token)
+    api = get_dataset_api()
 
-    predict_flood_model = joblib.load("Update_geo_script/models/model_XGBC_predict_flood.pkl")
-    predict_type_model = joblib.load("Update_geo_script/models/model_XGBC_flood_type.pkl")
+    with report.stage("load_models"):
+        predict_flood_model = joblib.load(PREDICT_FLOOD_MODEL_PATH)
+        predict_type_model = joblib.load(FLOOD_TYPE_MODEL_PATH)
     log("Models loaded successfully")
+    if type_threshold is not None:
+        log(f"Cascade mode: flood type predicted only where flood probability > {type_threshold}%")
+    total_predicted_rows = 0
+    total_typed_rows = 0
+    total_type_time = 0
+    failed_chunks = 0
     for start_idx in range(0, TOTAL_ROWS, CHUNK_SIZE):
         chunk_start_time = time.time()
         end_idx = min(start_idx + CHUNK_SIZE, TOTAL_ROWS)
@@ -287,62 +561,110 @@ def update_geo_data(gdf):
                 soil_moisture_data = Get_soil_moisture(lat, lon, end_date)
                 river_data = get_river_discharge(lat, lon, end_date)
                 marine_weather_data = Get_marine_weather(lat, lon, sea_lat, sea_lon, sea_distance, end_date)
-                weather_df = pd.concat(weather_data)
-                soil_moisture_df = pd.concat(soil_moisture_data)
-                river_df = pd.concat(river_data)
-                marine_df = pd.concat(marine_weather_data)
-                complete_df = pd.merge(weather_df, soil_moisture_df,on=["date", "lat", "lon", "date_id"])
-                complete_df = pd.merge(complete_df, river_df,on=["date", "lat", "lon", "date_id"])
-                complete_df = pd.merge(complete_df, marine_df,on=["date", "lat", "lon", "date_id"])
-                complete_df["month"] = complete_df['date'].dt.month
-
-                ordered_features = predict_flood_model.feature_names_in_
-                X = complete_df[ordered_features]
-                predicted_flood_proba = predict_flood_model.predict_proba(X)
-                predicted_type = predict_type_model.predict(X)
-
-                complete_df["flood_proba"] = np.round(predicted_flood_proba[:,1] * 100)
-                complete_df["flood_type"] = predicted_type
-
-                gdf.loc[chunk.index,:] = gdf.loc[chunk.index,:].apply(lambda x : update_gdf(x,complete_df), axis=1)
-                gdf.loc[chunk.index, 'last_update'] = now
+                with report.stage("merge"):
+                    complete_df = merge_chunk_data(weather_data, soil_moisture_data, river_data, marine_weather_data)
+                report.count("merge", rows=len(complete_df))
+
+                with report.stage("inference", rows=len(complete_df)):
+                    predicted_rows, typed_rows, type_time = predict_flood(complete_df, predict_flood_model, predict_type_model, type_threshold)
+                total_predicted_rows += predicted_rows
+                total_typed_rows += typed_rows
+                total_type_time += type_time
+                if type_threshold is not None:
+                    log(f"  Flood type skipped for {predicted_rows - typed_rows}/{predicted_rows} rows")
+
+                with report.stage("update_gdf", rows=len(chunk)):
+                    gdf.loc[chunk.index,:] = gdf.loc[chunk.index,:].apply(lambda x : update_gdf(x,complete_df), axis=1)
+                    gdf.loc[chunk.index, 'last_update'] = now
                 
                 log(f"✅ Successfully processed rows {start_idx}-{end_idx-1} at {now}")
                 log(f"  Chunk processing time: {time.time() - chunk_start_time:.2f} seconds")
-                upload_start = time.time()
-                gdf.to_file("europe_admin.geojson", driver="GeoJSON")
-                
-                api.upload_file(
-                    path_or_fileobj="europe_admin.geojson",  # Path to the local file
-                    path_in_repo="europe_admin.geojson",     # Path in the repository
-                    repo_id="AdrienD-Skep/geo_flood_data",       # Repository name
-                    repo_type="dataset",                     # Type of repository
-                )
-                log(f"✅ Upload completed in {time.time() - upload_start:.2f} seconds")
-                log("Waiting 65 seconds...")
-                time.sleep(65)
+                if upload:
+                    upload_geo_file(api, gdf)
+                log(f"Waiting {pause} seconds...")
+                with report.stage("sleep"):
+                    time.sleep(pause)
             except Exception as e:
                 log(f"❌ ERROR processing chunk {start_idx}-{end_idx-1}: {str(e)}")
-                log("Waiting 65 seconds...")
-                time.sleep(65)
+                failed_chunks += 1
+                report.count("failed_chunks", rows=len(chunk))
+                log(f"Waiting {pause} seconds...")
+                with report.stage("sleep"):
+                    time.sleep(pause)
         else:
             log(f"⏭️ Skipping chunk {start_idx}-{end_idx-1} - already up to date")
+            report.count("skipped", rows=len(chunk))
+    if upload:
+        upload_rollups(api, gdf)
     total_time = time.time() - start_time
     log(f"🎉 Finished updating geo file. Total time: {total_time:.2f} seconds")
     log(f"Average time per chunk: {total_time/(TOTAL_ROWS/CHUNK_SIZE):.2f} seconds")
+    # A run where chunks failed is faster, the failures must show in the report
+    report.info["failed_chunks"] = failed_chunks
+    if failed_chunks > 0:
+        log(f"⚠️ {failed_chunks} chunks failed")
+    if type_threshold is not None and total_predicted_rows > 0:
+        skipped_rows = total_predicted_rows - total_typed_rows
+        log(f"Cascade: flood type skipped for {skipped_rows}/{total_predicted_rows} rows ({skipped_rows / total_predicted_rows:.1%})")
+        report.info["cascade_skipped_rows"] = skipped_rows
+        if total_typed_rows > 0:
+            # Estimated from the per-row cost of the rows that did go through the type model
+            time_saved = total_type_time / total_typed_rows * skipped_rows
+            log(f"Cascade: flood type inference time {total_type_time:.2f} seconds, estimated {time_saved:.2f} seconds saved")
+            report.info["cascade_time_saved"] = time_saved
 
 if __name__ == "__main__":
-    log("Starting script...")
-    log("Downloading geo file from Hugging Face Hub...")
-    download_start = time.time()
-    geojson_path = hf_hub_download(
-        repo_id="AdrienD-Skep/geo_flood_data",  # Repository name
-        filename="europe_admin.geojson",    # File name in the repository
-        repo_type="dataset",                # Type of repository
-        token=hf_token,                        
-    )
-    log(f"Download completed in {time.time() - download_start:.2f} seconds")
+    parser = argparse.ArgumentParser(description="Update the european flood risk geo file")
+    parser.add_argument("--type-threshold", type=float, default=None,
+                        help="Cascade mode: only predict the flood type where the flood probability (%%) is above this threshold")
+    parser.add_argument("--shard", type=parse_shard, default=None,
+                        help="Only update the shard i of N (i/N) and write its partial file instead of uploading")
+    parser.add_argument("--merge", type=int, default=None, metavar="N",
+                        help="Merge the partial files of the N shards and upload the geo file")
+    parser.add_argument("--partial-dir", default="partials", help="Directory of the shard partial files")
+    parser.add_argument("--pause", type=float, default=65, help="Seconds to wait after each chunk (Open-Meteo limits)")
+    parser.add_argument("--report", default="run_report.json", help="JSON file of the per-stage timings and counters")
+    parser.add_argument("--prometheus", default=None, help="Also write the run report as a Prometheus textfile")
+    args = parser.parse_args()
 
-    log("Loading GeoDataFrame...")
-    gdf = gpd.read_file(geojson_path)
-    update_geo_data(gdf)
\ No newline at end of file
+    log("Starting script...")
+    try:
+        geojson_path = download_geo_file()
+
+        # Imported here, forecast_history itself imports this module
+        from forecast_history import append_run
+
+        log("Loading GeoDataFrame...")
+        with report.stage("load_geo_file"):
+            gdf = gpd.read_file(geojson_path)
+        report.count("load_geo_file", rows=len(gdf))
+        # Regions are identified by their row index in the published geo file
+        gdf["region_id"] = gdf.index
+        if args.merge is not None:
+            report.info["mode"] = f"merge {args.merge}"
+            log(f"Merging {args.merge} partial files from {args.partial_dir}...")
+            with report.stage("merge_partials", rows=len(gdf)):
+                merged_gdf = merge_partials(gdf, args.partial_dir, args.merge)
+            upload_geo_file(get_dataset_api(), merged_gdf)
+            upload_rollups(get_dataset_api(), merged_gdf)
+            with report.stage("history"):
+                append_run(get_dataset_api(), merged_gdf)
+        elif args.shard is not None:
+            shard_index, shard_count = args.shard
+            report.info["mode"] = f"shard {shard_index}/{shard_count}"
+            shard_gdf = select_shard(gdf, shard_index, shard_count)
+            log(f"Shard {shard_index}/{shard_count}: {len(shard_gdf)} of {len(gdf)} regions")
+            update_geo_data(shard_gdf, args.type_threshold, upload=False, pause=args.pause)
+            with report.stage("write_partial", rows=len(shard_gdf)):
+                write_partial(shard_gdf, args.partial_dir, shard_index, shard_count)
+        else:
+            report.info["mode"] = "full"
+            update_geo_data(gdf, args.type_threshold, pause=args.pause)
+            with report.stage("history"):
+                append_run(get_dataset_api(), gdf)
+    finally:
+        # Also written when the run fails, a partial report still tells where the time went
+        report.write_json(args.report)
+        if args.prometheus:
+            report.write_prometheus(args.prometheus)
+        log(f"Run report written to {args.report}")
\ No newline at end of file